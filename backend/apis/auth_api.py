@@ -1,16 +1,44 @@
 # backend/apis/auth_api.py
+import hmac
+from types import MappingProxyType
 from typing import Callable
-from sqlalchemy import select, func
+
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from models import User  # updated import path (single models file)
 from schemas import SignUpIn, LoginIn
 
+__all__ = ["SignUpAPI", "LoginAPI"]
+
+# Read-only envelope templates; only message/data vary per call
+_FAIL_TMPL = MappingProxyType({"status": "FAIL", "statusCode": 200, "message": "", "data": ""})
+_SUCCESS_TMPL = MappingProxyType({"status": "SUCCESS", "statusCode": 200, "message": "", "data": ""})
+
 def _fail(msg: str) -> dict:
-    return {"status": "FAIL", "statusCode": 200, "message": msg, "data": ""}
+    return {**_FAIL_TMPL, "message": msg}
 
 def _success(msg: str, data: str = "") -> dict:
-    return {"status": "SUCCESS", "statusCode": 200, "message": msg, "data": data}
+    return {**_SUCCESS_TMPL, "message": msg, "data": data}
+
+# argon2id with argon2-cffi's defaults; verification runs in libargon2 (C)
+_PH = PasswordHasher()
+# Verified against when the email is unknown, so that path costs the same argon2
+# work as a wrong password and timing doesn't reveal which emails are registered
+_DUMMY_HASH = _PH.hash("dummy-password-for-timing")
+
+def _verify_password(stored: str, given: str) -> tuple[bool, bool]:
+    """Returns (ok, needs_rehash). Rows created before hashing hold plaintext."""
+    if not stored.startswith("$argon2"):
+        ok = hmac.compare_digest(stored.encode("utf-8"), given.encode("utf-8"))
+        return ok, ok
+    try:
+        _PH.verify(stored, given)
+    except (VerificationError, InvalidHashError):
+        return False, False
+    return True, _PH.check_needs_rehash(stored)
 
 class SignUpAPI:
     def __init__(self, session_factory: Callable[[], Session]) -> None:
@@ -22,16 +50,16 @@ class SignUpAPI:
             return _fail("Email is required")
 
         with self.SessionLocal() as db:
-            # Case-insensitive uniqueness check
+            # Emails are stored lowercased, so compare the raw column (index seek, not a LOWER() scan)
             exists = db.execute(
-                select(User).where(func.lower(User.user_email) == email_norm)
+                select(User).where(User.user_email == email_norm)
             ).scalar_one_or_none()
             if exists:
                 return _fail("Email already exists")
 
             user = User(
                 user_email=email_norm,
-                user_password=payload.user_password,       # NOTE: store a hash in production
+                user_password=_PH.hash(payload.user_password),
                 user_firstname=(payload.user_firstname or "").strip() or None,
                 user_lastname=(payload.user_lastname or "").strip() or None,
                 user_university=(payload.user_university or "").strip() or None,
@@ -55,12 +83,20 @@ class LoginAPI:
 
         with self.SessionLocal() as db:
             user = db.execute(
-                select(User).where(func.lower(User.user_email) == email_norm)
+                select(User).where(User.user_email == email_norm)
             ).scalar_one_or_none()
 
-            # Simple comparison; replace with hashed password check in prod
-            if not user or user.user_password != payload.user_password:
+            if not user:
+                _verify_password(_DUMMY_HASH, payload.user_password)
+                return _fail("Invalid email or password")
+
+            ok, needs_rehash = _verify_password(user.user_password, payload.user_password)
+            if not ok:
                 return _fail("Invalid email or password")
+            if needs_rehash:
+                # upgrade legacy plaintext / outdated-parameter hashes on successful login
+                user.user_password = _PH.hash(payload.user_password)
+                db.commit()
 
             # You can later put a JWT or session token here; for now keep it a string
             return _success("Login successful", data=f"user_id={user.user_id}")
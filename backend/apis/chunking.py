@@ -0,0 +1,91 @@
+# backend/apis/chunking.py
+import logging
+import re
+from functools import lru_cache
+from typing import List
+
+try:
+    import tiktoken  # exact token counts for chunk packing
+except ImportError:  # pragma: no cover
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Without tiktoken, budgets are converted at ~4 chars per token of English text
+CHARS_PER_TOKEN = 4
+
+@lru_cache(maxsize=4)
+def _encoder(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:  # encoding files unavailable (e.g. offline): use the char heuristic
+        logger.warning("tiktoken encoding unavailable; chunking by characters")
+        return None
+
+_WORD_RE = re.compile(r"\S+\s*|\s+")
+
+def chunk_text(text: str, max_tokens: int, model: str) -> List[str]:
+    """Greedily pack whole lines into pieces of at most max_tokens, falling back to a char budget without tiktoken."""
+    enc = _encoder(model)
+    if enc is None:
+        return _chunk_chars(text, max_tokens * CHARS_PER_TOKEN)
+    lines = text.splitlines(keepends=True)
+    # one batched encode over every line; only the per-line token counts are kept
+    sizes = [len(t) for t in enc.encode_ordinary_batch(lines)]
+    return [b for b in (b.strip() for b in _pack_tokens(enc, lines, sizes, max_tokens)) if b]
+
+def _pack_tokens(enc, pieces: List[str], sizes: List[int], max_tokens: int) -> List[str]:
+    # Text is only ever cut between pieces, so nothing splits mid-word or inside a
+    # multibyte character the way slicing the token stream would.
+    buckets: List[str] = []
+    cur: List[str] = []
+    size = 0
+    for piece, n in zip(pieces, sizes):
+        if n > max_tokens:
+            # a single over-long line is split between words; a lone giant "word" by characters
+            if cur:
+                buckets.append("".join(cur))
+                cur, size = [], 0
+            words = _WORD_RE.findall(piece)
+            if len(words) > 1:
+                word_sizes = [len(t) for t in enc.encode_ordinary_batch(words)]
+                buckets.extend(_pack_tokens(enc, words, word_sizes, max_tokens))
+            else:
+                step = max(1, len(piece) * max_tokens // n)
+                buckets.extend(piece[i:i + step] for i in range(0, len(piece), step))
+            continue
+        if cur and size + n > max_tokens:
+            buckets.append("".join(cur))
+            cur, size = [], 0
+        cur.append(piece)
+        size += n
+    if cur:
+        buckets.append("".join(cur))
+    return buckets
+
+def _chunk_chars(text: str, max_chars: int) -> List[str]:
+    """Greedily pack whole lines into pieces of at most max_chars (one pass, no rescans)."""
+    buckets: List[str] = []
+    cur: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        # a single over-long line still has to be cut somewhere
+        while len(line) > max_chars:
+            if cur:
+                buckets.append("".join(cur))
+                cur, size = [], 0
+            buckets.append(line[:max_chars])
+            line = line[max_chars:]
+        if cur and size + len(line) > max_chars:
+            buckets.append("".join(cur))
+            cur, size = [], 0
+        cur.append(line)
+        size += len(line)
+    if cur:
+        buckets.append("".join(cur))
+    return [b for b in (b.strip() for b in buckets) if b]
@@ -0,0 +1,17 @@
+# backend/apis/db.py
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+# --- The one session factory shared by every content API module ---
+_SESSION_FACTORY: Optional[Callable[[], Session]] = None
+
+def set_session_factory(factory: Callable[[], Session]) -> None:
+    global _SESSION_FACTORY
+    _SESSION_FACTORY = factory
+
+def get_session_factory() -> Callable[[], Session]:
+    # FastAPI dependency; app.py also calls it once at boot so a missing factory fails fast
+    if _SESSION_FACTORY is None:
+        raise RuntimeError("Server misconfigured: no DB session factory is set.")
+    return _SESSION_FACTORY
@@ -1,61 +1,120 @@
 # backend/apis/flashcards_api.py
-import os
+import re
 import json
-from typing import Callable, List, Optional
+import hashlib
+import logging
+from typing import Any, Callable, List, Optional
 
-from fastapi import Body
-from sqlalchemy import select, delete
+from fastapi import Body, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, delete, insert, text
 from sqlalchemy.orm import Session
 
 from models import Course, Flashcard
-from openai import OpenAI
+from apis.db import get_session_factory
+from apis.llm_cache import make_cache_key, acache_get, acache_set
+from apis.openai_client import get_openai_client
+from apis.chunking import chunk_text
 
-_SESSION_FACTORY: Optional[Callable[[], Session]] = None
+logger = logging.getLogger(__name__)
 
-def set_session_factory_for_flashcards(factory: Callable[[], Session]) -> None:
-    global _SESSION_FACTORY
-    _SESSION_FACTORY = factory
+OPENAI_MODEL = "gpt-4o-mini"
+FLASHCARD_MAX_INPUT_TOKENS = 6_000  # course text sent per generation
+FLASHCARD_SAMPLE_CHUNK_TOKENS = 750  # longer courses are sampled in pieces this size
+FLASHCARD_CALL_TIMEOUT = 30.0       # seconds
+
+# orjson is much faster than stdlib json; fall back if it isn't installed
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+def _json_loads(raw: str):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
 def _fail(msg: str) -> dict:
     return {"status": "FAIL", "statusCode": 200, "message": msg, "data": ""}
 
-def _success(data_str: str, message: str = "") -> dict:
-    return {"status": "SUCCESS", "statusCode": 200, "message": message, "data": data_str}
+# 'data' holds plain Python objects; the app's ORJSONResponse encodes the whole envelope once
+def _success(data: Any, message: str = "") -> dict:
+    return {"status": "SUCCESS", "statusCode": 200, "message": message, "data": data}
+
+# Over-long card text is cut at the last line break/space before the limit rather
+# than mid-word. Only a small window before the limit is scanned, in one regex pass.
+_TRIM_RE = re.compile(r"\s+")
+_TRIM_WINDOW = 200
+
+def _safe_trim(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    m = None
+    for m in _TRIM_RE.finditer(text, max(0, limit - _TRIM_WINDOW), limit):
+        pass
+    cut = m.start() if m else limit
+    return text[:cut].rstrip()
 
-def _get_openai_client() -> OpenAI:
-    key = os.getenv("OPENAI_API_KEY", "").strip()
-    if not key:
-        raise RuntimeError("Missing OPENAI_API_KEY")
-    return OpenAI(api_key=key)
+def _flashcards_format(n: int) -> dict:
+    # Structured output: the model must return {"cards": [{front, back} x n]} as valid JSON
+    return {
+        "type": "json_schema",
+        "name": "flashcards",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "cards": {
+                    "type": "array",
+                    "minItems": n,
+                    "maxItems": n,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "front": {"type": "string"},
+                            "back": {"type": "string"},
+                        },
+                        "required": ["front", "back"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["cards"],
+            "additionalProperties": False,
+        },
+    }
 
-def _generate_flashcards_from_text(text: str, n: int = 10) -> List[dict]:
-    client = _get_openai_client()
-    system = (
-        "You create educational flashcards. "
-        "Keep language simple and clear. Each card has a concise front (prompt) and a helpful back (answer)."
+# Built once at import; only n and the content are substituted per call
+_FLASHCARD_PROMPT_TMPL = (
+    "You create educational flashcards. "
+    "Keep language simple and clear. Each card has a concise front (prompt) and a helpful back (answer)."
+    "\n\n"
+    "From the content below, create EXACTLY {n} flashcards. "
+    "Return them in 'cards', each with keys 'front' and 'back'. "
+    "Front: a short question/fill-in/prompt. Back: a brief but clear answer or explanation.\n\n"
+    "<content>\n"
+    "{text}\n"
+    "</content>"
+)
+
+async def _generate_flashcards_from_text(text: str, n: int = 10) -> tuple[List[dict], bool]:
+    """Returns (cards, cache_hit)."""
+    prompt = _FLASHCARD_PROMPT_TMPL.format(n=n, text=text)
+    cache_key = "cards:" + make_cache_key(OPENAI_MODEL, prompt, n)
+    cached = await acache_get(cache_key)
+    if cached is not None:
+        return cached, True
+
+    client = get_openai_client().with_options(timeout=FLASHCARD_CALL_TIMEOUT)
+    resp = await client.responses.create(
+        model=OPENAI_MODEL,
+        input=prompt,
+        temperature=0.2,
+        text={"format": _flashcards_format(n)},
     )
-    user = (
-        "From the content below, create EXACTLY {n} flashcards. "
-        "Return ONLY a strict JSON array of objects with keys 'front' and 'back' (no markdown, no extra text). "
-        "Front: a short question/fill-in/prompt. Back: a brief but clear answer or explanation.\n\n"
-        "<content>\n"
-        f"{text}\n"
-        "</content>"
-    ).replace("{n}", str(n))
-
-    resp = client.responses.create(model="gpt-4o-mini", input=f"{system}\n\n{user}", temperature=0.2)
-    raw = getattr(resp, "output_text", None) or str(resp)
+    raw = getattr(resp, "output_text", None) or ""
 
-    try:
-        data = json.loads(raw)
-        if not isinstance(data, list):
-            raise ValueError("not a list")
-    except Exception:
-        start = raw.find("["); end = raw.rfind("]")
-        if start != -1 and end != -1 and end > start:
-            data = json.loads(raw[start:end+1])
-        else:
-            raise ValueError("Model did not return JSON")
+    data = _json_loads(raw)["cards"]
 
     cards: List[dict] = []
     for item in data:
@@ -63,7 +122,7 @@ def _generate_flashcards_from_text(text: str, n: int = 10) -> List[dict]:
         front = str(item.get("front", "")).strip()
         back = str(item.get("back", "")).strip()
         if front and back:
-            cards.append({"front": front[:500], "back": back[:1200]})
+            cards.append({"front": _safe_trim(front, 500), "back": _safe_trim(back, 1200)})
         if len(cards) == n: break
 
     if len(cards) < n:
@@ -71,73 +130,135 @@ def _generate_flashcards_from_text(text: str, n: int = 10) -> List[dict]:
             cards.append({"front": f"Key idea {len(cards)+1}?", "back": "Brief explanation."})
     elif len(cards) > n:
         cards = cards[:n]
-    return cards
-
-def create_or_replace_flashcards(course_id: int):
-    if _SESSION_FACTORY is None:
-        return _fail("Server misconfigured: no DB session factory is set.")
+    await acache_set(cache_key, cards)
+    return cards, False
 
+# Blocking DB work; called through run_in_threadpool from the async handler
+def _fetch_course_row(factory: Callable[[], Session], course_id: int):
     # fetch only needed columns (avoid non-existent fields)
-    with _SESSION_FACTORY() as db:
-        row = db.execute(
+    with factory() as db:
+        return db.execute(
             select(Course.course_id, Course.course_name, Course.course_content)
             .where(Course.course_id == course_id)
         ).one_or_none()
-        if not row:
-            return _fail(f"Course id={course_id} not found")
 
-        _, _, content = row
-        content = (content or "").strip()
-        if not content:
-            return _fail(f"Course id={course_id} has no content")
+def _replace_flashcards(factory: Callable[[], Session], course_id: int, cards: List[dict]) -> None:
+    with factory() as db:
+        db.execute(delete(Flashcard).where(Flashcard.course_id == course_id))
+        # one executemany INSERT instead of a unit-of-work flush per card
+        rows = [
+            {"course_id": course_id, "card_index": idx,
+             "front_text": card["front"], "back_text": card["back"]}
+            for idx, card in enumerate(cards, start=1)
+        ]
+        if rows:
+            db.execute(insert(Flashcard), rows)
+        db.commit()
+
+def _flashcard_input(content: str) -> tuple[str, int, int]:
+    """
+    Returns (text, used, total) chunks. A course over the token budget is sampled
+    evenly across its chunks, so every file of a multi-file course is represented
+    instead of only the first one(s).
+    """
+    parts = chunk_text(content, FLASHCARD_SAMPLE_CHUNK_TOKENS, OPENAI_MODEL)
+    k = FLASHCARD_MAX_INPUT_TOKENS // FLASHCARD_SAMPLE_CHUNK_TOKENS
+    if len(parts) <= k:
+        return content, len(parts), len(parts)
+    picks = sorted({round(i * (len(parts) - 1) / (k - 1)) for i in range(k)})
+    return "\n\n[...]\n\n".join(parts[i] for i in picks), len(picks), len(parts)
+
+async def create_or_replace_flashcards(
+    course_id: int,
+    factory: Callable[[], Session] = Depends(get_session_factory),
+):
+    row = await run_in_threadpool(_fetch_course_row, factory, course_id)
+    if not row:
+        return _fail(f"Course id={course_id} not found")
+
+    _, _, content = row
+    content = (content or "").strip()
+    if not content:
+        return _fail(f"Course id={course_id} has no content")
+
+    source, used, total = await run_in_threadpool(_flashcard_input, content)
+    if used < total:
+        logger.info("flashcards.sampled_input", extra={"course_id": course_id, "chunks_used": used, "chunks_total": total})
 
     try:
-        cards = _generate_flashcards_from_text(content, n=10)
+        cards, cache_hit = await _generate_flashcards_from_text(source, n=10)
     except RuntimeError as e:
         return _fail(str(e))
     except Exception as e:
         return _fail(f"AI call failed: {type(e).__name__}")
 
-    with _SESSION_FACTORY() as db:
-        db.execute(delete(Flashcard).where(Flashcard.course_id == course_id))
-        for idx, card in enumerate(cards, start=1):
-            db.add(Flashcard(course_id=course_id, card_index=idx,
-                             front_text=card["front"], back_text=card["back"]))
-        db.commit()
+    await run_in_threadpool(_replace_flashcards, factory, course_id, cards)
 
-    return _success(f"Inserted 10 flashcards for course_id={course_id}",
-                    message="Flashcards generated and replaced successfully.")
+    message = "Flashcards generated and replaced successfully."
+    if used < total:
+        message += f" The course is long, so they cover an even sample of {used} of its {total} sections."
+    resp = _success(f"Inserted 10 flashcards for course_id={course_id}", message=message)
+    resp["x-cache"] = "HIT" if cache_hit else "MISS"
+    return resp
 
 
 # ---------------- GET: /courses/{course_id}/flashcards ----------------
-def get_flashcards(course_id: int):
+# Plain SQL read: no ORM identity map / Flashcard object construction per row
+_LIST_FLASHCARDS_SQL = text(
+    "SELECT flashcard_id, card_index, front_text, back_text FROM flashcards "
+    "WHERE course_id = :course_id ORDER BY card_index ASC"
+)
+
+def _flashcards_etag(course_id: int, rows) -> str:
+    # Hash the card rows themselves: ids alone aren't a version, since SQLite reuses
+    # rowids after the delete + re-insert done on regeneration. A course has ~10
+    # cards, so reading them just to hash is cheap.
+    h = hashlib.blake2s(str(course_id).encode())
+    for row in rows:
+        for value in row:
+            h.update(str(value).encode("utf-8"))
+            h.update(b"\x1f")
+    return f'W/"{h.hexdigest()}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {t.strip() for t in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+def get_flashcards(
+    course_id: int,
+    request: Request,
+    response: Response,
+    factory: Callable[[], Session] = Depends(get_session_factory),
+):
     """
     GET /courses/{course_id}/flashcards
     Returns flashcards for the course, ordered by card_index.
-    Response 'data' is a JSON string of:
+    Response 'data' is a list of:
       [{ "flashcard_id": ..., "card_index": 1, "front_text": "...", "back_text": "..." }, ...]
+    Sends a weak ETag; a matching If-None-Match gets 304 Not Modified with no body.
     """
-    if _SESSION_FACTORY is None:
-        return _fail("Server misconfigured: no DB session factory is set.")
-
-    with _SESSION_FACTORY() as db:
-        rows = db.execute(
-            select(Flashcard)
-            .where(Flashcard.course_id == course_id)
-            .order_by(Flashcard.card_index.asc())
-        ).scalars().all()
-
-        payload = [
-            {
-                "flashcard_id": r.flashcard_id,
-                "card_index": r.card_index,
-                "front_text": r.front_text,
-                "back_text": r.back_text,
-            }
-            for r in rows
-        ]
+    with factory() as db:
+        rows = db.execute(_LIST_FLASHCARDS_SQL, {"course_id": course_id}).all()
 
+    etag = _flashcards_etag(course_id, rows)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    payload = [
+        {
+            "flashcard_id": flashcard_id,
+            "card_index": card_index,
+            "front_text": front_text,
+            "back_text": back_text,
+        }
+        for flashcard_id, card_index, front_text, back_text in rows
+    ]
+
+    response.headers.update(cache_headers)
     return _success(
-        data_str=json.dumps(payload, ensure_ascii=False),
+        data=payload,
         message=f"Fetched {len(payload)} flashcard(s) for course_id={course_id}."
-    )
\ No newline at end of file
+    )
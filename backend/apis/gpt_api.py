@@ -1,105 +1,402 @@
 # backend/apis/gpt_api.py
 import os
-import json
+import io
+import asyncio
+import hashlib
+import logging
+import re
 import pathlib
-from tempfile import NamedTemporaryFile
-from typing import Callable, List, Optional
+import zipfile
+import threading
+import atexit
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Union
 
 from dotenv import load_dotenv
-from fastapi import HTTPException, UploadFile, File, Form, Body
-from sqlalchemy import select, func, delete
+from fastapi import HTTPException, UploadFile, File, Form, Body, Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, func, delete, insert, text, bindparam
 from sqlalchemy.orm import Session
 
 # File parsers
 import pdfplumber
+try:
+    import fitz  # PyMuPDF: much faster plain-text extraction than pdfplumber
+except ImportError:  # pragma: no cover
+    fitz = None
 from docx import Document as DocxDocument
 from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from lxml import etree
 
 # DB models
 from models import Course, Summary
 from fastapi import Query
 
 # OpenAI for AI-powered summarization
-from openai import OpenAI
+from apis.db import get_session_factory
+from apis.openai_client import get_openai_client
+from apis.chunking import chunk_text
+from openai import APIError
+from apis.llm_cache import CACHE_TTL_SECONDS, make_cache_key, acache_get, acache_set, doc_cache_get, doc_cache_set
 
 load_dotenv()
 
-# --- Global session factory ---
-_SESSION_FACTORY: Optional[Callable[[], Session]] = None
-def set_session_factory(factory: Callable[[], Session]) -> None:
-    global _SESSION_FACTORY
-    _SESSION_FACTORY = factory
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = "gpt-4o-mini"
 
 # --- Helper responses ---
 def _fail(msg: str) -> dict:
     return {"status": "FAIL", "statusCode": 200, "message": msg, "data": ""}
 
-def _success(data_str: str, message: str = "") -> dict:
-    return {"status": "SUCCESS", "statusCode": 200, "message": message, "data": data_str}
+# 'data' holds plain Python objects; the app's ORJSONResponse encodes the whole envelope once
+def _success(data: Any, message: str = "") -> dict:
+    return {"status": "SUCCESS", "statusCode": 200, "message": message, "data": data}
 
 # --- File extraction helpers ---
 MAX_BYTES = 50 * 1024 * 1024  # 50 MB
 
-def _read_pdf(path: str) -> str:
-    parts: List[str] = []
-    with pdfplumber.open(path) as pdf:
-        for p in pdf.pages:
-            parts.append(p.extract_text() or "")
-    return "\n".join(parts).strip()
-
-def _read_docx(path: str) -> str:
-    doc = DocxDocument(path)
-    return "\n".join(p.text for p in doc.paragraphs).strip()
-
-def _read_pptx(path: str) -> str:
-    prs = Presentation(path)
-    parts: List[str] = []
-    for slide in prs.slides:
-        for shape in slide.shapes:
-            if hasattr(shape, "text"):
-                parts.append(shape.text)
-    return "\n".join(parts).strip()
-
-def _extract_text_from_upload(upload: UploadFile) -> str:
-    name = upload.filename or "uploaded"
-    _, ext = os.path.splitext(name.lower())
+# Shared executors: worker threads/processes are started once and reused across
+# requests instead of being spun up (and torn down) per upload.
+IO_POOL = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 4) * 4), thread_name_prefix="extract")
+_PARSE_POOL: Optional[ProcessPoolExecutor] = None
+_PARSE_POOL_LOCK = threading.Lock()
+# Set only inside parse-pool workers (via the pool initializer), so a worker never
+# fans out into a pool of its own. parent_process() can't tell: the server itself
+# is a multiprocessing child under uvicorn --reload / --workers.
+_IN_PARSE_WORKER = False
+
+# Never fork: the server already runs anyio/IO_POOL threads and httpx, and a forked
+# child can inherit a lock (e.g. a logging handler's) held by one of them and hang.
+# forkserver forks from a clean single-threaded helper; spawn where it's unavailable.
+_PARSE_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+def _mark_parse_worker() -> None:
+    global _IN_PARSE_WORKER
+    _IN_PARSE_WORKER = True
+
+def _parse_pool() -> ProcessPoolExecutor:
+    # created lazily: starting processes at import time breaks Windows spawn
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None:
+            _PARSE_POOL = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=_PARSE_MP_CONTEXT,
+                initializer=_mark_parse_worker,
+            )
+        return _PARSE_POOL
+
+def _reset_parse_pool(broken: ProcessPoolExecutor) -> None:
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is broken:
+            _PARSE_POOL = None
+    broken.shutdown(wait=False)
+
+@atexit.register
+def _shutdown_pools() -> None:
+    IO_POOL.shutdown(wait=False, cancel_futures=True)
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown(wait=False, cancel_futures=True)
+
+def _join_lines(texts: Iterable[str]) -> str:
+    # Stream pieces into one StringIO rather than materialising a list of every page/paragraph
+    buf = io.StringIO()
+    for t in texts:
+        if t:
+            buf.write(t)
+            buf.write("\n")
+    return buf.getvalue().strip()
+
+PDF_PARALLEL_MIN_PAGES = 10
+# Optional cap on pages read per PDF (0 = all), bounding parse cost for huge uploads
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 0))
+
+def _page_limit(page_count: int) -> int:
+    return min(page_count, PDF_MAX_PAGES) if PDF_MAX_PAGES > 0 else page_count
+
+def _extract_pdf_pages(data: bytes, page_numbers: Optional[List[int]]) -> List[str]:
+    # Each worker opens its own handle: pdfplumber/pdfminer objects aren't safe to share across threads
+    with pdfplumber.open(io.BytesIO(data), pages=page_numbers) as pdf:
+        return [p.extract_text() or "" for p in pdf.pages]
+
+def _read_pdf_pdfplumber(data: bytes, num_workers: Optional[int] = None) -> str:
+    workers = num_workers or min(os.cpu_count() or 1, 8)
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        total_pages = len(pdf.pages)
+    page_count = _page_limit(total_pages)
+
+    if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+        pages = None if page_count == total_pages else list(range(1, page_count + 1))
+        return _join_lines(_extract_pdf_pages(data, pages))
+
+    # contiguous 1-based page ranges, one per worker; ex.map keeps them in order
+    step = -(-page_count // workers)
+    ranges = [list(range(start, min(start + step, page_count + 1))) for start in range(1, page_count + 1, step)]
+    chunks = IO_POOL.map(lambda r: _extract_pdf_pages(data, r), ranges)
+    return _join_lines(text for chunk in chunks for text in chunk)
+
+# Big PDFs are split into page ranges across the parse pool (MuPDF isn't
+# thread-safe, so processes, each opening its own document). Past the byte cap,
+# shipping the file to every worker costs more than the parallelism saves.
+PDF_PROCESS_MIN_PAGES = 40
+PDF_PROCESS_MAX_BYTES = 20 * 1024 * 1024
+
+def _fitz_page_texts(data: bytes, start: int, stop: int) -> List[str]:
+    # module-level so it pickles into the parse pool
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return [doc[i].get_text("text") for i in range(start, stop)]
+
+def _read_pdf_fitz(data: bytes) -> str:
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        page_count = _page_limit(doc.page_count)
+        if (
+            page_count < PDF_PROCESS_MIN_PAGES
+            or len(data) > PDF_PROCESS_MAX_BYTES
+            or _IN_PARSE_WORKER
+        ):
+            return _join_lines(doc[i].get_text("text") for i in range(page_count))
+
+    step = -(-page_count // (os.cpu_count() or 1))
+    starts = list(range(0, page_count, step))
+    stops = [min(start + step, page_count) for start in starts]
+    pool = _parse_pool()
+    try:
+        chunks = list(pool.map(_fitz_page_texts, [data] * len(starts), starts, stops))
+    except BrokenProcessPool:
+        _reset_parse_pool(pool)  # a worker died; start fresh on the next upload
+        raise
+    return _join_lines(text for chunk in chunks for text in chunk)
 
-    upload.file.seek(0, os.SEEK_END)
-    size = upload.file.tell()
-    upload.file.seek(0)
-    if size > MAX_BYTES:
-        raise HTTPException(status_code=413, detail=f"{name} exceeds {MAX_BYTES // (1024*1024)}MB limit")
+def _read_pdf(data: bytes) -> str:
+    if fitz is not None:
+        try:
+            return _read_pdf_fitz(data)
+        except BrokenProcessPool:
+            # _read_pdf_fitz already dropped the dead pool; the next big PDF gets a fresh one
+            logger.warning("pdf.parse_pool_broken; falling back to pdfplumber")
+        except Exception:
+            # encrypted/exotic PDF: let pdfplumber have a go
+            logger.warning("pdf.fitz_failed; falling back to pdfplumber", exc_info=True)
+    return _read_pdf_pdfplumber(data)
+
+# DOCX/PPTX are zipped OOXML; for plain text it's much cheaper to XPath the
+# underlying XML with lxml than to build python-docx/python-pptx object trees.
+_OOXML_NS = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+    "mc": "http://schemas.openxmlformats.org/markup-compatibility/2006",
+}
+_SLIDE_RE = re.compile(r"^ppt/slides/slide(\d+)\.xml$")
+
+# Text-bearing elements inside a paragraph, in Clark notation. Tabs and breaks are
+# rendered the way python-docx/python-pptx do, so words don't run together.
+_W = "{%s}" % _OOXML_NS["w"]
+_A = "{%s}" % _OOXML_NS["a"]
+_RUN_TAGS = {
+    "w": {f"{_W}t": None, f"{_W}tab": "\t", f"{_W}br": "\n", f"{_W}cr": "\n"},
+    "a": {f"{_A}t": None, f"{_A}br": "\n"},
+}
+# Only direct run content, as python-docx/python-pptx read it. A descendant walk
+# would also pick up text boxes (w:txbxContent) and the duplicate copy Word writes
+# under mc:Fallback in mc:AlternateContent.
+_RUN_CHILDREN = {
+    "w": etree.XPath("./w:r/* | ./w:hyperlink/w:r/*", namespaces=_OOXML_NS),
+    "a": etree.XPath("./a:r/a:t | ./a:fld/a:t | ./a:br", namespaces=_OOXML_NS),
+}
+_SLIDE_PARAGRAPHS = etree.XPath(".//a:p[not(ancestor::mc:Fallback)]", namespaces=_OOXML_NS)
+
+def _parse_xml(raw: bytes):
+    # Uploads are untrusted: no entity expansion, no network fetches (same as python-docx)
+    return etree.fromstring(raw, etree.XMLParser(resolve_entities=False, no_network=True))
+
+def _paragraph_texts(paragraphs, prefix: str) -> Iterator[str]:
+    tags = _RUN_TAGS[prefix]
+    children = _RUN_CHILDREN[prefix]
+    for p in paragraphs:
+        yield "".join(
+            (el.text or "") if tags[el.tag] is None else tags[el.tag]
+            for el in children(p)
+            if el.tag in tags
+        )
 
-    with NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-        tmp.write(upload.file.read())
-        tmp_path = tmp.name
+def _read_docx_python_docx(data: bytes) -> str:
+    doc = DocxDocument(io.BytesIO(data))
+    return _join_lines(p.text for p in doc.paragraphs)
 
+def _read_docx(data: bytes) -> str:
     try:
-        if ext == ".pdf":
-            text = _read_pdf(tmp_path)
-        elif ext == ".docx":
-            text = _read_docx(tmp_path)
-        elif ext == ".pptx":
-            text = _read_pptx(tmp_path)
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            root = _parse_xml(z.read("word/document.xml"))
+        body = root.find("w:body", _OOXML_NS)
+        # top-level body paragraphs only, same as python-docx's doc.paragraphs
+        return _join_lines(_paragraph_texts(body.iterfind("w:p", _OOXML_NS), "w"))
+    except Exception:
+        return _read_docx_python_docx(data)
+
+def _iter_shape_texts(shapes) -> Iterator[str]:
+    # Recurse into group shapes, whose children are otherwise never visited
+    for s in shapes:
+        if s.shape_type == MSO_SHAPE_TYPE.GROUP:
+            yield from _iter_shape_texts(s.shapes)
         else:
-            raise HTTPException(status_code=415, detail=f"Unsupported file type '{ext}'. Use PDF, DOCX, or PPTX.")
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+            t = getattr(s, "text", "")
+            if t:
+                yield t
+
+def _read_pptx_python_pptx(data: bytes) -> str:
+    prs = Presentation(io.BytesIO(data))
+    return _join_lines(t for slide in prs.slides for t in _iter_shape_texts(slide.shapes))
+
+def _read_pptx(data: bytes) -> str:
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            slides = sorted(
+                (int(m.group(1)), name)
+                for name in z.namelist()
+                if (m := _SLIDE_RE.match(name))
+            )
+            return _join_lines(
+                t
+                for _, name in slides
+                for t in _paragraph_texts(_SLIDE_PARAGRAPHS(_parse_xml(z.read(name))), "a")
+            )
+    except Exception:
+        return _read_pptx_python_pptx(data)
+
+COPY_CHUNK_BYTES = 1024 * 1024  # 1 MB
+
+def _read_upload_in_place(upload: UploadFile, size: int) -> Optional[bytearray]:
+    """
+    readinto() straight into one preallocated buffer: no per-chunk bytes objects and
+    no final BytesIO copy. Returns None if the stream doesn't match the reported size.
+    """
+    readinto = getattr(upload.file, "readinto", None)
+    if readinto is None:
+        return None
+    buf = bytearray(size)
+    with memoryview(buf) as view:
+        total = 0
+        while total < size:
+            n = readinto(view[total:total + COPY_CHUNK_BYTES])
+            if not n:
+                break
+            total += n
+    if total != size or upload.file.read(1):
+        return None
+    return buf
+
+def _read_upload(upload: UploadFile) -> Union[bytes, bytearray]:
+    """
+    Read the upload into memory. All parsers take in-memory streams, so nothing is
+    spilled to a temp file. MAX_BYTES is enforced before and while reading, so an
+    oversized file is rejected without buffering all of it.
+    """
+    name = upload.filename or "uploaded"
+    too_large = HTTPException(status_code=413, detail=f"{name} exceeds {MAX_BYTES // (1024*1024)}MB limit")
+
+    # the multipart parser already knows the size; reject before reading a byte
+    size = getattr(upload, "size", None) or 0
+    if size > MAX_BYTES:
+        raise too_large
+
+    if size:
+        upload.file.seek(0)
+        data = _read_upload_in_place(upload, size)
+        if data is not None:
+            return data
+
+    # size unknown (or wrong): 1 MB chunks with a running total
+    upload.file.seek(0)
+    buf = io.BytesIO()
+    total = 0
+    while chunk := upload.file.read(COPY_CHUNK_BYTES):
+        total += len(chunk)
+        if total > MAX_BYTES:
+            raise too_large
+        buf.write(chunk)
+    return buf.getvalue()
+
+# Extension -> reader over the raw bytes; register new formats here
+_PARSERS: dict[str, Callable[[bytes], str]] = {
+    ".pdf": _read_pdf,
+    ".docx": _read_docx,
+    ".pptx": _read_pptx,
+}
+
+def _extract_text_from_bytes(name: str, data: bytes) -> str:
+    _, ext = os.path.splitext(name.lower())
+
+    parser = _PARSERS.get(ext)
+    if parser is None:
+        raise HTTPException(status_code=415, detail=f"Unsupported file type '{ext}'. Use PDF, DOCX, or PPTX.")
+    text = parser(data)
 
     if not text:
         raise HTTPException(status_code=400, detail=f"No readable text found in {name}. If it is a scanned PDF, add OCR.")
     return text
 
+# Extracted text is cached by a hash of the file bytes, so re-uploading the
+# same document skips the parser entirely.
+DOC_CACHE_TTL = 24 * 60 * 60
+
+def _doc_cache_key(name: str, data: bytes) -> str:
+    _, ext = os.path.splitext(name.lower())
+    # the page cap changes what a PDF extracts to, so it's part of the key
+    return f"doc:{ext}:{PDF_MAX_PAGES}:{hashlib.sha256(data).hexdigest()}"
+
+def _extract_text_worker(name: str, data: bytes) -> tuple[Optional[str], Optional[tuple[int, str]]]:
+    """
+    Process-pool entry point. Must stay module-level so it pickles (incl. Windows spawn).
+    HTTPException doesn't survive pickling, so errors travel back as (status_code, detail).
+    """
+    try:
+        return _extract_text_from_bytes(name, data), None
+    except HTTPException as e:
+        return None, (e.status_code, str(e.detail))
+
 def _extract_many(uploads: List[UploadFile]) -> List[tuple[str, str]]:
-    out: List[tuple[str, str]] = []
-    for up in uploads:
-        text = _extract_text_from_upload(up)
-        stem = pathlib.Path(up.filename or "uploaded").stem
-        out.append((stem, text))
-    return out
+    # Read every upload on this thread (UploadFile isn't thread-safe), then parse
+    # in separate processes: the parsers are CPU-bound Python and would fight over the GIL.
+    names = [up.filename or "uploaded" for up in uploads]
+    payloads = [_read_upload(up) for up in uploads]
+
+    keys = [_doc_cache_key(name, data) for name, data in zip(names, payloads)]
+    texts: List[Optional[str]] = [doc_cache_get(key) for key in keys]
+    for name, key, text in zip(names, keys, texts):
+        if text is not None:
+            logger.info("doc.cache_hit", extra={"doc_name": name, "cache_key": key})
+
+    misses = [i for i, text in enumerate(texts) if text is None]
+    if len(misses) == 1:
+        i = misses[0]
+        texts[i] = _extract_text_from_bytes(names[i], payloads[i])
+    elif misses:
+        pool = _parse_pool()
+        try:
+            results = list(pool.map(
+                _extract_text_worker,
+                [names[i] for i in misses],
+                [payloads[i] for i in misses],
+            ))
+        except BrokenProcessPool:
+            _reset_parse_pool(pool)  # a worker died; start fresh on the next upload
+            raise
+        for i, (text, error) in zip(misses, results):
+            if error is not None:
+                raise HTTPException(status_code=error[0], detail=error[1])
+            texts[i] = text
+    for i in misses:
+        doc_cache_set(keys[i], texts[i], ttl=DOC_CACHE_TTL)
+
+    return [(pathlib.Path(name).stem, text) for name, text in zip(names, texts)]
 
 def _derive_course_name(stems: List[str], override: Optional[str]) -> str:
     if override:
@@ -111,15 +408,24 @@ def _derive_course_name(stems: List[str], override: Optional[str]) -> str:
         base += f" (+{len(stems)-3} more)"
     return base[:255]
 
+def _insert_course(factory: Callable[[], Session], name: str, content: str) -> int:
+    # INSERT ... RETURNING: one statement gives us the id, no flush round trip
+    with factory() as db:
+        new_id = db.execute(
+            insert(Course)
+            .values(course_name=name, course_content=content)
+            .returning(Course.course_id)
+        ).scalar_one()
+        db.commit()
+    return new_id
+
 # --- POST /addcourse ---
 def ingest_and_store_endpoint(
     files: Optional[List[UploadFile]] = File(default=None),
     course_name: Optional[str] = Form(default=None),
     body: Optional[dict] = Body(default=None),
+    factory: Callable[[], Session] = Depends(get_session_factory),
 ):
-    if _SESSION_FACTORY is None:
-        return _fail("Server misconfigured: no DB session factory is set.")
-
     try:
         if files is not None and len(files) > 0:
             extracted = _extract_many(files)
@@ -131,12 +437,7 @@ def ingest_and_store_endpoint(
                 return _fail("No readable text found in uploaded files.")
 
             final_name = _derive_course_name(stems, course_name)
-            with _SESSION_FACTORY() as db:
-                row = Course(course_name=final_name, course_content=combined_content)
-                db.add(row)
-                db.flush()
-                new_id = row.course_id
-                db.commit()
+            new_id = _insert_course(factory, final_name, combined_content)
 
             return _success(
                 f"Saved 1 course(s): {final_name}=>id={new_id}",
@@ -149,12 +450,7 @@ def ingest_and_store_endpoint(
             if not content:
                 return _fail("Content is empty.")
 
-            with _SESSION_FACTORY() as db:
-                row = Course(course_name=cname, course_content=content)
-                db.add(row)
-                db.flush()
-                new_id = row.course_id
-                db.commit()
+            new_id = _insert_course(factory, cname, content)
 
             return _success(
                 f"Saved 1 course(s): {cname}=>id={new_id}",
@@ -170,131 +466,405 @@ def ingest_and_store_endpoint(
         return _fail(f"Ingestion failed: {type(e).__name__}")
 
 # --- GET /courses ---
-def list_courses(limit: int = 25, offset: int = 0, q: Optional[str] = None):
-    if _SESSION_FACTORY is None:
-        return _fail("Server misconfigured: no DB session factory is set.")
-
-    with _SESSION_FACTORY() as db:
-        stmt = select(
-            Course.course_id,
-            Course.course_name,
-            func.length(Course.course_content).label("content_len"),
-        )
+# Hand-written SQL for the hot list path: skips ORM/Core statement building and
+# the rows are unpacked as plain tuples.
+_LIST_COURSES_SQL = text(
+    "SELECT course_id, course_name, LENGTH(course_content) FROM courses "
+    "ORDER BY course_id DESC LIMIT :limit OFFSET :offset"
+)
+# ILIKE without LOWER() on the column so the course_name trigram index applies;
+# Core's ilike() renders the right operator for each dialect.
+_SEARCH_COURSES_STMT = (
+    select(Course.course_id, Course.course_name, func.length(Course.course_content))
+    .where(Course.course_name.ilike(bindparam("pattern")))
+    .order_by(Course.course_id.desc())
+    .limit(bindparam("limit"))
+    .offset(bindparam("offset"))
+)
+
+def list_courses(
+    limit: int = 25,
+    offset: int = 0,
+    q: Optional[str] = None,
+    factory: Callable[[], Session] = Depends(get_session_factory),
+):
+    with factory() as db:
+        params = {"limit": limit, "offset": offset}
         if q:
-            from sqlalchemy import func as _func
-            stmt = stmt.where(_func.lower(Course.course_name).like(f"%{q.lower()}%"))
-        stmt = stmt.order_by(Course.course_id.desc()).offset(offset).limit(limit)
+            params["pattern"] = f"%{q}%"
+            rows = db.execute(_SEARCH_COURSES_STMT, params).all()
+        else:
+            rows = db.execute(_LIST_COURSES_SQL, params).all()
 
-        rows = db.execute(stmt).all()
         payload = [
-            {"course_id": r.course_id, "course_name": r.course_name, "content_len": int(r.content_len or 0)}
-            for r in rows
+            {"course_id": cid, "course_name": cname, "content_len": int(clen or 0)}
+            for cid, cname, clen in rows
         ]
-        return _success(json.dumps(payload, ensure_ascii=False), message=f"Fetched {len(payload)} course(s).")
+        return _success(payload, message=f"Fetched {len(payload)} course(s).")
 
 # --- GET /courses/{course_id} ---
-def get_course(course_id: int):
-    if _SESSION_FACTORY is None:
-        return _fail("Server misconfigured: no DB session factory is set.")
+# Server-side cursor for the big TEXT columns so the driver doesn't buffer the
+# whole result client-side before SQLAlchemy sees it.
+_STREAM_OPTS = {"stream_results": True, "yield_per": 1}
+
+def get_course(
+    course_id: int,
+    preview: int = Query(0, ge=0, description="Return only the first N chars of course_content (0 = full)"),
+    factory: Callable[[], Session] = Depends(get_session_factory),
+):
+    # Truncate in SQL so multi-MB content never leaves the database for a preview
+    content_col = (
+        func.substr(Course.course_content, 1, preview) if preview > 0 else Course.course_content
+    )
 
-    with _SESSION_FACTORY() as db:
+    with factory() as db:
         row = db.execute(
-            select(Course.course_id, Course.course_name, Course.course_content)
-            .where(Course.course_id == course_id)
+            select(
+                Course.course_id,
+                Course.course_name,
+                content_col,
+                func.length(Course.course_content),
+            )
+            .where(Course.course_id == course_id),
+            execution_options=_STREAM_OPTS,
         ).one_or_none()
 
         if not row:
             return _fail(f"Course id={course_id} not found")
 
-        course_id_db, course_name_db, content = row
+        course_id_db, course_name_db, content, content_len = row
         payload = {
             "course_id": course_id_db,
             "course_name": course_name_db,
             "course_content": content,
+            "content_len": int(content_len or 0),
         }
-        return _success(json.dumps(payload, ensure_ascii=False), message=f"Fetched course id={course_id}.")
+        return _success(payload, message=f"Fetched course id={course_id}.")
 
 # --- POST /courses/{course_id}/summary ---
-def generate_course_summary(course_id: int, body: dict = Body(...)):
-    """
-    Generate or replace a summary for a given course_id and length: short|medium|long
-    """
-    if _SESSION_FACTORY is None:
-        return _fail("Server misconfigured: no DB session factory is set.")
-
-    summary_length = body.get("summary_length")
-    summary_map = {"short": 300, "medium": 700, "long": 1200}
-    max_chars = summary_map.get(summary_length.lower())
-    if not max_chars:
-        return _fail("Invalid summary_length. Use one of: short, medium, long.")
-
-    with _SESSION_FACTORY() as db:
-        row = db.execute(
+# Blocking DB work; called through run_in_threadpool from the async handler
+def _fetch_course_row(factory: Callable[[], Session], course_id: int):
+    with factory() as db:
+        return db.execute(
             select(Course.course_id, Course.course_name, Course.course_content)
             .where(Course.course_id == course_id)
         ).one_or_none()
-        if not row:
-            return _fail(f"Course id={course_id} not found")
 
-        _, cname, content = row
-        content = (content or "").strip()
-        if not content:
-            return _fail(f"Course id={course_id} has no content")
+def _replace_summary(factory: Callable[[], Session], course_id: int, summary_length: str, summary_text: str) -> None:
+    with factory() as db:
+        db.execute(
+            delete(Summary).where(Summary.course_id == course_id, Summary.summary_length == summary_length)
+        )
+        db.add(Summary(course_id=course_id, summary_length=summary_length, summary_content=summary_text))
+        db.commit()
 
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    system_prompt = (
-        f"You are a helpful teaching assistant. Summarize the following course material in {summary_length} form. "
+# Long courses are summarized map-reduce style: each chunk is summarized in
+# parallel, then one final call merges the partial summaries.
+SUMMARY_CHUNK_TOKENS = 3_000  # token budget per chunk (~12 000 chars of English without tiktoken)
+SUMMARY_MAX_PARALLEL = 8      # cap concurrent OpenAI calls across all requests (rate limits)
+SUMMARY_SINGLE_PASS_MAX_CHUNKS = 4
+SUMMARY_SINGLE_PASS_MAX_CHARS = 40_000
+SUMMARY_REDUCE_MAX_CHARS = 40_000  # budget for the partial summaries merged in one reduce call
+SUMMARY_CALL_TIMEOUT = 30.0   # seconds per OpenAI call
+SUMMARY_CACHE_TTL = int(os.getenv("SUM_CACHE_TTL", CACHE_TTL_SECONDS))
+
+# Prompt skeletons are built once at import; only the per-call fields are filled in.
+_SUMMARY_SYSTEM_PROMPTS = {
+    length: (
+        f"You are a helpful teaching assistant. Summarize the following course material in {length} form. "
         "Explain concepts in very simple, clear language that any student can understand. "
         "Avoid jargon. Use bullet points and short sentences."
     )
+    for length in ("short", "medium", "long")
+}
+_SINGLE_TMPL = "{system}\n\nSummarize this course content:\n\n{content}"
+_MARKED_TMPL = (
+    "{system}\n\nThe course content below is split into {n} chunks marked "
+    "<<CHUNK n>>. Write one unified summary covering all of them:{marked}"
+)
+_MAP_TMPL = "{system}\n\nSummarize part {i} of {n} of this course content:\n\n{part}"
+_REDUCE_TMPL = "{system}\n\nCombine these partial summaries of one course into a single summary:\n\n{merged}"
+
+# One semaphore per event loop, shared by every request on it, so the cap holds
+# process-wide rather than per request. asyncio primitives bind to the first loop
+# that waits on them, so a single module-level one breaks under a second loop.
+_LLM_SEMS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _llm_sem() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _LLM_SEMS.get(loop)
+    if sem is None:
+        sem = _LLM_SEMS[loop] = asyncio.Semaphore(SUMMARY_MAX_PARALLEL)
+    return sem
+
+async def _complete(prompt: str, max_tokens: int) -> str:
+    # Per-call timeout plus a hard output cap keep one slow response from pinning the request
+    client = get_openai_client().with_options(timeout=SUMMARY_CALL_TIMEOUT)
+    async with _llm_sem():
+        resp = await client.responses.create(
+            model=OPENAI_MODEL,
+            input=prompt,
+            max_output_tokens=max_tokens,
+        )
+    return getattr(resp, "output_text", None) or str(resp)
 
-    user_prompt = f"Summarize this course content:\n\n{content[:4000]}"
+async def _summarize_content(system_prompt: str, parts: List[str], max_tokens: int) -> tuple[str, int]:
+    """
+    Returns (summary, dropped): dropped counts map/reduce calls that failed and were
+    left out, so callers can avoid persisting a summary built from only some chunks.
+    parts come from chunk_text, run off the event loop by the caller.
+    """
+    if len(parts) <= 1:
+        text = await _complete(_SINGLE_TMPL.format(system=system_prompt, content="".join(parts)), max_tokens)
+        return text, 0
+
+    # A handful of chunks still fits one context window: a single marked-up request
+    # beats map + reduce (half the calls, no second round trip).
+    if len(parts) <= SUMMARY_SINGLE_PASS_MAX_CHUNKS and sum(len(p) for p in parts) < SUMMARY_SINGLE_PASS_MAX_CHARS:
+        marked = "".join(f"\n\n<<CHUNK {i}>>\n{p}" for i, p in enumerate(parts, start=1))
+        text = await _complete(
+            _MARKED_TMPL.format(system=system_prompt, n=len(parts), marked=marked),
+            max_tokens,
+        )
+        return text, 0
 
-    try:
-        resp = client.responses.create(
-            model="gpt-4o-mini",
-            input=f"{system_prompt}\n\n{user_prompt}",
-            max_output_tokens=max_chars,
+    async def _map(i: int, part: str) -> str:
+        return await _complete(
+            _MAP_TMPL.format(system=system_prompt, i=i, n=len(parts), part=part),
+            max_tokens,
         )
-        summary_text = getattr(resp, "output_text", None) or str(resp)
+
+    async def _reduce(group: List[str]) -> str:
+        merged = "\n\n".join(f"Part {i}:\n{t}" for i, t in enumerate(group, start=1))
+        return await _complete(_REDUCE_TMPL.format(system=system_prompt, merged=merged), max_tokens)
+
+    partials = _successful("map", await asyncio.gather(
+        *(_map(i, p) for i, p in enumerate(parts, start=1)),
+        return_exceptions=True,
+    ))
+    dropped = len(parts) - len(partials)
+    # Reduce as a tree: merge groups that fit one call until a single summary is left,
+    # so the final prompt stays bounded however many chunks the course has.
+    while len(partials) > 1:
+        groups = _group_partials(partials, SUMMARY_REDUCE_MAX_CHARS)
+        partials = _successful("reduce", await asyncio.gather(*(_reduce(g) for g in groups), return_exceptions=True))
+        dropped += len(groups) - len(partials)
+    return partials[0], dropped
+
+def _successful(stage: str, results: List[Any]) -> List[str]:
+    # One failed OpenAI call (timeout, 429, 5xx) shouldn't sink the whole summary; only
+    # give up if every call failed. Anything else is a bug and propagates.
+    ok: List[str] = []
+    for i, r in enumerate(results, start=1):
+        if isinstance(r, BaseException) and not isinstance(r, APIError):
+            raise r
+        if isinstance(r, BaseException):
+            logger.warning(
+                "summary.part_failed",
+                extra={"stage": stage, "part": i, "of": len(results), "error": type(r).__name__},
+            )
+        else:
+            ok.append(r)
+    if not ok:
+        raise next(r for r in results if isinstance(r, BaseException))
+    return ok
+
+def _group_partials(partials: List[str], max_chars: int) -> List[List[str]]:
+    """Pack consecutive partials into groups under max_chars; at least two per group so each round shrinks."""
+    groups: List[List[str]] = []
+    cur: List[str] = []
+    size = 0
+    for p in partials:
+        if len(cur) >= 2 and size + len(p) > max_chars:
+            groups.append(cur)
+            cur, size = [], 0
+        cur.append(p)
+        size += len(p)
+    if len(cur) == 1 and groups:
+        groups[-1].append(cur[0])  # a lone leftover would just be carried to the next round
+    elif cur:
+        groups.append(cur)
+    return groups
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+def _extractive_preview(parts: List[str], max_chars: int) -> str:
+    """Cheap stand-in summary: the first sentence of each chunk, as bullets."""
+    points: List[str] = []
+    for part in parts:
+        first = _SENTENCE_END_RE.split(part.replace("\n", " "), maxsplit=1)[0].strip()
+        if first:
+            points.append(f"- {first}")
+    return "\n".join(points)[:max_chars]
+
+# In-flight summary jobs, per process: cache_key -> Task, so repeated POSTs on a miss
+# join the running map-reduce instead of queueing another. _SUMMARY_STATE keeps the
+# latest pending/failed state per (course_id, summary_length) for GET to report.
+_SUMMARY_JOBS: "dict[str, asyncio.Task]" = {}
+_SUMMARY_STATE: "dict[tuple[int, str], tuple[str, str]]" = {}
+
+async def _summarize_and_store(
+    factory: Callable[[], Session],
+    course_id: int,
+    summary_length: str,
+    system_prompt: str,
+    parts: List[str],
+    max_chars: int,
+    cache_key: str,
+) -> tuple[str, int]:
+    """Returns (summary, dropped); only a complete summary is cached and stored."""
+    state_key = (course_id, summary_length)
+    try:
+        summary_text, dropped = await _summarize_content(system_prompt, parts, max_chars)
     except Exception as e:
-        return _fail(f"AI summarization failed: {type(e).__name__}")
+        logger.exception("summary.job_failed", extra={"course_id": course_id})
+        _SUMMARY_STATE[state_key] = ("failed", f"AI summarization failed: {type(e).__name__}")
+        raise
+    if dropped:
+        # built from only some chunks: don't cache or store it as if it were complete
+        logger.warning("summary.partial_not_stored", extra={"course_id": course_id, "dropped": dropped})
+        _SUMMARY_STATE[state_key] = ("failed", f"{dropped} AI call(s) failed; summary was not stored")
+        return summary_text, dropped
+    await acache_set(cache_key, summary_text, ttl=SUMMARY_CACHE_TTL)
+    await run_in_threadpool(_replace_summary, factory, course_id, summary_length, summary_text)
+    _SUMMARY_STATE.pop(state_key, None)
+    return summary_text, 0
+
+def _summary_job(cache_key: str, factory: Callable[[], Session], course_id: int,
+                 summary_length: str, system_prompt: str, parts: List[str], max_chars: int) -> asyncio.Task:
+    job = _SUMMARY_JOBS.get(cache_key)
+    if job is not None and not job.done():
+        return job
+    _SUMMARY_STATE[(course_id, summary_length)] = ("pending", "")
+    job = asyncio.create_task(_summarize_and_store(
+        factory, course_id, summary_length, system_prompt, parts, max_chars, cache_key,
+    ))
+    _SUMMARY_JOBS[cache_key] = job
+
+    def _done(t: asyncio.Task) -> None:
+        if _SUMMARY_JOBS.get(cache_key) is t:
+            del _SUMMARY_JOBS[cache_key]
+        if not t.cancelled():
+            t.exception()  # already logged in the job; mark it retrieved
+
+    job.add_done_callback(_done)
+    return job
+
+async def generate_course_summary(
+    course_id: int,
+    body: dict = Body(...),
+    factory: Callable[[], Session] = Depends(get_session_factory),
+):
+    """
+    Generate or replace a summary for a given course_id and length: short|medium|long.
+    On a cache miss the LLM summary is produced in the background: the response carries
+    a quick extractive preview with message 'pending', and the final summary is
+    available from GET /courses/{course_id}/summary once stored. A POST while that job
+    is still running joins it rather than starting another.
+    Pass {"wait": true} to block until the LLM summary is ready instead.
+    """
+    summary_length = (body.get("summary_length") or "").lower()
+    summary_map = {"short": 300, "medium": 700, "long": 1200}
+    max_chars = summary_map.get(summary_length)
+    if not max_chars:
+        return _fail("Invalid summary_length. Use one of: short, medium, long.")
 
-    with _SESSION_FACTORY() as db:
-        db.execute(
-            delete(Summary).where(Summary.course_id == course_id, Summary.summary_length == summary_length)
+    row = await run_in_threadpool(_fetch_course_row, factory, course_id)
+    if not row:
+        return _fail(f"Course id={course_id} not found")
+
+    _, cname, content = row
+    content = (content or "").strip()
+    if not content:
+        return _fail(f"Course id={course_id} has no content")
+
+    system_prompt = _SUMMARY_SYSTEM_PROMPTS[summary_length]
+
+    cache_key = "sum:" + make_cache_key(OPENAI_MODEL, system_prompt, content, max_chars)
+    summary_text = await acache_get(cache_key)
+    if summary_text is not None:
+        await run_in_threadpool(_replace_summary, factory, course_id, summary_length, summary_text)
+        _SUMMARY_STATE.pop((course_id, summary_length), None)
+        resp = _success(
+            summary_text,
+            message=f"Summary ({summary_length}) generated and stored for course_id={course_id}."
         )
-        db.add(Summary(course_id=course_id, summary_length=summary_length, summary_content=summary_text))
-        db.commit()
+        resp["x-cache"] = "HIT"
+        return resp
 
-    return _success(
-        summary_text,
-        message=f"Summary ({summary_length}) generated and stored for course_id={course_id}."
-    )
+    try:
+        get_openai_client()  # surface a missing API key now, not inside the background job
+    except RuntimeError as e:
+        return _fail(str(e))
+
+    # Tokenizing a multi-MB course (and tiktoken's first-use load) is CPU/IO work:
+    # do it once, off the event loop, and share the parts with preview and LLM passes.
+    parts = await run_in_threadpool(chunk_text, content, SUMMARY_CHUNK_TOKENS, OPENAI_MODEL)
+    job = _summary_job(cache_key, factory, course_id, summary_length, system_prompt, parts, max_chars)
+
+    if not body.get("wait"):
+        resp = _success(
+            _extractive_preview(parts, max_chars),
+            message=(
+                f"pending: summary ({summary_length}) for course_id={course_id} is being generated; "
+                f"GET /courses/{course_id}/summary?summary_length={summary_length} to fetch it."
+            ),
+        )
+        resp["x-cache"] = "MISS"
+        return resp
+
+    try:
+        # shield: a client disconnect cancels this handler, not the shared job
+        summary_text, dropped = await asyncio.shield(job)
+    except Exception as e:
+        return _fail(f"AI summarization failed: {type(e).__name__}")
+    if dropped:
+        message = (
+            f"partial: {dropped} AI call(s) failed, so this summary ({summary_length}) "
+            f"for course_id={course_id} was not stored; retry to get a complete one."
+        )
+    else:
+        message = f"Summary ({summary_length}) generated and stored for course_id={course_id}."
+    resp = _success(summary_text, message=message)
+    resp["x-cache"] = "MISS"
+    return resp
 
 
 def get_course_summary(
     course_id: int,
     summary_length: str = Query(..., description="short | medium | long"),
+    factory: Callable[[], Session] = Depends(get_session_factory),
 ):
     """
     GET /courses/{course_id}/summary?summary_length=short|medium|long
-    Returns the stored summary for (course_id, summary_length).
+    Returns the stored summary for (course_id, summary_length). While a POST-started
+    job is running, or after it failed, the message says so (the stored row, if any,
+    is from an earlier generation).
     """
-    if _SESSION_FACTORY is None:
-        return _fail("Server misconfigured: no DB session factory is set.")
-
     length = (summary_length or "").strip().lower()
     if length not in {"short", "medium", "long"}:
         return _fail("Invalid summary_length. Use one of: short, medium, long.")
 
-    with _SESSION_FACTORY() as db:
+    state, detail = _SUMMARY_STATE.get((course_id, length), ("", ""))
+    if state == "pending":
+        note = "pending: a new summary is being generated; this is the previous one."
+    elif state == "failed":
+        note = f"failed: the last generation did not complete ({detail}); this is the previous one."
+    else:
+        note = ""
+
+    with factory() as db:
         row = db.execute(
             select(Summary.summary_id, Summary.summary_content)
-            .where(Summary.course_id == course_id, Summary.summary_length == length)
+            .where(Summary.course_id == course_id, Summary.summary_length == length),
+            execution_options=_STREAM_OPTS,
         ).one_or_none()
 
         if not row:
+            if state == "pending":
+                return _fail(f"pending: summary ({length}) for course_id={course_id} is still being generated.")
+            if state == "failed":
+                return _fail(f"failed: summary ({length}) for course_id={course_id} could not be generated ({detail}).")
             return _fail(
                 f"No summary found for course_id={course_id} and length='{length}'. "
                 f"POST /courses/{course_id}/summary to generate one."
@@ -308,6 +878,6 @@ def get_course_summary(
             "summary_content": summary_content,
         }
         return _success(
-            data_str=json.dumps(payload, ensure_ascii=False),
-            message=f"Fetched summary for course_id={course_id}, length={length}."
+            data=payload,
+            message=" ".join(filter(None, (f"Fetched summary for course_id={course_id}, length={length}.", note))),
         )
\ No newline at end of file
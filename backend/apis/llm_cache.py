@@ -0,0 +1,152 @@
+# backend/apis/llm_cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Optional shared backend: set REDIS_URL to share the cache across workers/restarts.
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+# Cache for LLM outputs, keyed by a hash of (model, prompt, params).
+# Identical requests skip the OpenAI round trip entirely.
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # 7 days
+CACHE_MAX_ENTRIES = 512
+REDIS_TIMEOUT_SECONDS = 0.5  # a slow/hung Redis degrades to the local cache instead of stalling requests
+
+_CACHE: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+# cache_get/cache_set run on threadpool workers too (ingestion, Redis calls), and
+# OrderedDict reordering isn't safe against concurrent access
+_CACHE_LOCK = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _redis_client():
+    # resolved lazily: .env is loaded after this module is imported
+    url = os.getenv("REDIS_URL", "").strip()
+    if not url:
+        return None
+    if redis is None:
+        logger.warning("REDIS_URL is set but the redis package isn't installed; using the in-process cache")
+        return None
+    return redis.Redis.from_url(
+        url,
+        socket_timeout=REDIS_TIMEOUT_SECONDS,
+        socket_connect_timeout=REDIS_TIMEOUT_SECONDS,
+    )
+
+def make_cache_key(*parts: Any) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x1f")  # field separator so ("ab", "c") != ("a", "bc")
+    return h.hexdigest()
+
+def _local_get(key: str, store: "OrderedDict[str, tuple[float, Any]]" = _CACHE) -> Optional[Any]:
+    entry = store.get(key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+        _local_pop(key, store)
+        return None
+    store.move_to_end(key)
+    return value
+
+def _local_pop(key: str, store: "OrderedDict[str, tuple[float, Any]]") -> None:
+    global _DOC_CACHE_CHARS
+    entry = store.pop(key, None)
+    if entry is not None and store is _DOC_CACHE:
+        _DOC_CACHE_CHARS -= len(entry[1])
+
+def _local_set(key: str, value: Any, ttl: int) -> None:
+    _CACHE[key] = (time.monotonic() + ttl, value)
+    _CACHE.move_to_end(key)
+    while len(_CACHE) > CACHE_MAX_ENTRIES:
+        _CACHE.popitem(last=False)
+
+def _redis_get(key: str) -> tuple[bool, Optional[Any]]:
+    """(answered, value); answered is False without Redis or when it's unreachable."""
+    client = _redis_client()
+    if client is None:
+        return False, None
+    try:
+        raw = client.get(key)
+    except redis.RedisError:
+        return False, None  # Redis down: degrade to the in-process cache
+    return True, (json.loads(raw) if raw is not None else None)
+
+def _redis_set(key: str, value: Any, ttl: int) -> bool:
+    client = _redis_client()
+    if client is None:
+        return False
+    try:
+        client.setex(key, ttl, json.dumps(value, ensure_ascii=False))
+    except redis.RedisError:
+        return False
+    return True
+
+def cache_get(key: str) -> Optional[Any]:
+    answered, value = _redis_get(key)
+    if answered:
+        return value
+    with _CACHE_LOCK:
+        return _local_get(key)
+
+def cache_set(key: str, value: Any, ttl: int = CACHE_TTL_SECONDS) -> None:
+    if not _redis_set(key, value, ttl):
+        with _CACHE_LOCK:
+            _local_set(key, value, ttl)
+
+# Extracted document texts get their own store, bounded by total size rather than
+# entry count: one upload can be tens of MB, and it mustn't push LLM results out.
+DOC_CACHE_MAX_CHARS = 64 * 1024 * 1024
+DOC_CACHE_MAX_ENTRY_CHARS = 8 * 1024 * 1024  # bigger texts aren't cached at all
+
+_DOC_CACHE: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+_DOC_CACHE_CHARS = 0
+_DOC_CACHE_LOCK = threading.Lock()  # ingestion runs on threadpool workers
+
+def doc_cache_get(key: str) -> Optional[str]:
+    answered, value = _redis_get(key)
+    if answered:
+        return value
+    with _DOC_CACHE_LOCK:
+        return _local_get(key, _DOC_CACHE)
+
+def doc_cache_set(key: str, text: str, ttl: int) -> None:
+    global _DOC_CACHE_CHARS
+    if len(text) > DOC_CACHE_MAX_ENTRY_CHARS or _redis_set(key, text, ttl):
+        return
+    with _DOC_CACHE_LOCK:
+        _local_pop(key, _DOC_CACHE)
+        _DOC_CACHE[key] = (time.monotonic() + ttl, text)
+        _DOC_CACHE_CHARS += len(text)
+        while _DOC_CACHE_CHARS > DOC_CACHE_MAX_CHARS:
+            _, (_, evicted) = _DOC_CACHE.popitem(last=False)
+            _DOC_CACHE_CHARS -= len(evicted)
+
+# Async callers must use these: the redis client is blocking, so its round trip
+# runs in the threadpool. Without Redis the in-process dict is read inline.
+async def acache_get(key: str) -> Optional[Any]:
+    if _redis_client() is None:
+        with _CACHE_LOCK:
+            return _local_get(key)
+    return await run_in_threadpool(cache_get, key)
+
+async def acache_set(key: str, value: Any, ttl: int = CACHE_TTL_SECONDS) -> None:
+    if _redis_client() is None:
+        with _CACHE_LOCK:
+            _local_set(key, value, ttl)
+        return
+    await run_in_threadpool(cache_set, key, value, ttl)
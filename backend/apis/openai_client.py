@@ -0,0 +1,20 @@
+# backend/apis/openai_client.py
+import os
+from functools import lru_cache
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
+
+# One shared client per process so httpx keeps its connection pool (and TLS
+# sessions) warm across requests instead of re-handshaking on every LLM call.
+# HTTP/2 lets the concurrent summary map calls share a few multiplexed connections.
+@lru_cache(maxsize=1)
+def get_openai_client() -> AsyncOpenAI:
+    key = os.getenv("OPENAI_API_KEY", "").strip()
+    if not key:
+        raise RuntimeError("Missing OPENAI_API_KEY")
+    http_client = DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+    return AsyncOpenAI(api_key=key, max_retries=2, timeout=60, http_client=http_client)
@@ -1,12 +1,15 @@
 # backend/models/db_model.py
 from __future__ import annotations
+import logging
 from typing import Optional
 
 from sqlalchemy import (
-    Integer, String, Text, UniqueConstraint, ForeignKey
+    Integer, String, Text, UniqueConstraint, ForeignKey, select, update, func, text
 )
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
 class User(Base):
@@ -15,7 +18,7 @@ class User(Base):
 
     user_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_email: Mapped[str] = mapped_column(String(255), nullable=False)
-    user_password: Mapped[str] = mapped_column(String(255), nullable=False)  # hash in prod
+    user_password: Mapped[str] = mapped_column(String(255), nullable=False)  # argon2id hash
     user_firstname: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     user_lastname: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     user_university: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
@@ -47,5 +50,57 @@ class Flashcard(Base):
     front_text: Mapped[str] = mapped_column(Text, nullable=False)
     back_text: Mapped[str] = mapped_column(Text, nullable=False)
 
+def _lowercase_legacy_emails(engine) -> None:
+    # Auth looks users up with a plain equality on user_email (so uq_user_email's
+    # index is used), which requires every stored email to be lowercase.
+    # Only rows that are alone in their lower(user_email) group are rewritten; the
+    # group is computed up front, so two legacy spellings of one address can't both
+    # be lowered into a unique violation (Postgres evaluates the subquery once).
+    lowered = func.lower(User.user_email)
+    counts = (
+        select(lowered.label("email"), func.count().label("n"))
+        .group_by(lowered)
+        .subquery()
+    )
+    unique_emails = select(counts.c.email).where(counts.c.n == 1)
+    colliding_emails = select(counts.c.email).where(counts.c.n > 1)
+    with engine.begin() as conn:
+        conn.execute(
+            update(User)
+            .where(User.user_email != lowered, lowered.in_(unique_emails))
+            .values(user_email=lowered)
+            .execution_options(synchronize_session=False)
+        )
+        collisions = conn.execute(
+            select(User.user_id, User.user_email)
+            .where(User.user_email != lowered, lowered.in_(colliding_emails))
+        ).all()
+    for user_id, email in collisions:
+        # left as-is; these accounts can't log in until merged or renamed by hand
+        logger.warning("user.email_case_collision", extra={"user_id": user_id, "user_email": email})
+
+def _create_course_search_index(engine) -> None:
+    # /courses?q= does a case-insensitive substring match on course_name; a plain
+    # btree can't serve a leading-% ILIKE, so use a trigram index on Postgres.
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as conn:
+            if dialect == "postgresql":
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_courses_name_trgm "
+                    "ON courses USING gin (course_name gin_trgm_ops)"
+                ))
+            elif dialect == "sqlite":
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_courses_name_nocase "
+                    "ON courses (course_name COLLATE NOCASE)"
+                ))
+    except Exception:
+        # e.g. no privilege to create the extension; search still works, just unindexed
+        pass
+
 def init_models(engine) -> None:
     Base.metadata.create_all(engine)
+    _lowercase_legacy_emails(engine)
+    _create_course_search_index(engine)